@@ -0,0 +1,318 @@
+# -*- coding: utf-8 -*-
+"""
+HTTP load testing of the API served by threadpool server.
+"""
+
+import bisect
+import csv
+import logging
+import math
+import multiprocessing
+import random
+import threading
+import urllib2
+from datetime import date, timedelta
+from timeit import default_timer as timer
+
+log = logging.getLogger(__name__)  # pylint: disable=invalid-name
+
+# URLs of endpoints, formatted with random user id.
+ENDPOINTS = {
+    'users': '/api/v1/users',
+    'mean_time_weekday': '/api/v1/mean_time_weekday/{0}',
+    'presence_weekday': '/api/v1/presence_weekday/{0}',
+    'top': '/api/v1/top/presence?n=10',
+}
+
+DEFAULT_MIX = 'users:1,mean_time_weekday:3,presence_weekday:3,top:1'
+
+
+def generate_data(path, users=100, days=250, seed=None):
+    """
+    Writes random presence data of given number of users to CSV file.
+
+    Every user gets an entry for most of working days in a period of given
+    length ending yesterday. Returns number of written rows.
+    """
+    rand = random.Random(seed)
+    first_day = date.today() - timedelta(days=days)
+    rows = 0
+    with open(path, 'wb') as csvfile:
+        writer = csv.writer(csvfile, delimiter=',')
+        for user_id in xrange(10, 10 + users):
+            for offset in xrange(days):
+                day = first_day + timedelta(days=offset)
+                if day.weekday() > 4 or rand.random() < 0.1:
+                    continue
+                start = rand.randint(7 * 3600, 10 * 3600)
+                end = start + rand.randint(4 * 3600, 9 * 3600)
+                writer.writerow([
+                    user_id,
+                    day.isoformat(),
+                    format_seconds(start),
+                    format_seconds(end),
+                ])
+                rows += 1
+    return rows
+
+
+def format_seconds(seconds):
+    """
+    Formats amount of seconds since midnight as HH:MM:SS.
+    """
+    return '{0:02d}:{1:02d}:{2:02d}'.format(
+        seconds // 3600, seconds % 3600 // 60, seconds % 60
+    )
+
+
+def parse_mix(mix):
+    """
+    Parses request mix like 'users:1,presence_weekday:3'.
+
+    Returns list of (endpoint, weight) tuples.
+    """
+    result = []
+    for item in mix.split(','):
+        name, _, weight = item.strip().partition(':')
+        if name not in ENDPOINTS:
+            raise ValueError('Unknown endpoint: {0}'.format(name))
+        weight = int(weight or 1)
+        if weight < 0:
+            raise ValueError('Negative weight of {0}'.format(name))
+        result.append((name, weight))
+    if not sum(weight for _, weight in result):
+        raise ValueError('Request mix is empty')
+    return result
+
+
+def percentile(values, percent):
+    """
+    Calculates percentile of sorted values (nearest rank method).
+    Returns zero for empty lists.
+    """
+    if not values:
+        return 0
+    rank = int(math.ceil(percent / 100.0 * len(values)))
+    return values[min(max(rank, 1), len(values)) - 1]
+
+
+def make_server(application, host='127.0.0.1', port=0, workers=50,
+                spawn_if_under=5, max_requests=200):
+    """
+    Creates Paste threadpool server configured like in deploy.ini.
+
+    Its address is available as server.server_address.
+    """
+    from paste import httpserver
+
+    return httpserver.serve(
+        application,
+        host=host,
+        port=port,
+        start_loop=False,
+        use_threadpool=True,
+        threadpool_workers=workers,
+        threadpool_options={
+            'spawn_if_under': spawn_if_under,
+            'max_requests': max_requests,
+        },
+    )
+
+
+def serve(application, **options):
+    """
+    Serves application in background thread, see make_server().
+
+    Returns server, which should be stopped with shutdown().
+    """
+    server = make_server(application, **options)
+    server.thread = threading.Thread(target=server.serve_forever)
+    server.thread.daemon = True
+    server.thread.start()
+    return server
+
+
+def shutdown(server):
+    """
+    Stops server started by serve().
+
+    Paste server overrides serve_forever(), which doesn't cooperate with
+    BaseServer.shutdown(), and stops when its `running` flag is cleared.
+    """
+    server.running = False
+    server.thread.join()
+    server.server_close()
+
+
+def serve_process(application, timeout=30, **options):
+    """
+    Serves application in child process, see make_server().
+
+    Server doesn't share interpreter lock with clients sending requests,
+    so they don't skew its throughput and latency. Returns the process,
+    which should be terminated, and server address.
+    """
+    receiver, sender = multiprocessing.Pipe(duplex=False)
+    process = multiprocessing.Process(
+        target=_serve_forever,
+        args=(sender, application),
+        kwargs=options,
+    )
+    process.daemon = True
+    process.start()
+    sender.close()
+    try:
+        if not receiver.poll(timeout):
+            raise EOFError()
+        address = receiver.recv()
+    except EOFError:
+        address = None
+    finally:
+        receiver.close()
+
+    if not isinstance(address, tuple):
+        process.terminate()
+        raise RuntimeError('Server did not start: {0!r}'.format(address))
+    return process, address
+
+
+def _serve_forever(sender, application, **options):
+    """
+    Starts server and sends its address (or error) through the pipe.
+    """
+    try:
+        server = make_server(application, **options)
+    except Exception as error:  # pylint: disable=broad-except
+        sender.send(error)
+        sender.close()
+        return
+    sender.send(server.server_address)
+    sender.close()
+    server.serve_forever()
+
+
+def run_loadtest(base_url, user_ids, mix=DEFAULT_MIX, concurrency=10,
+                 requests=1000, timeout=30, seed=None):
+    """
+    Sends requests to API endpoints from concurrent clients.
+
+    Endpoints are picked randomly according to weights from request mix
+    (string or result of parse_mix()), users are picked randomly from
+    given user ids. Returns results of every endpoint and of all requests,
+    see summarize().
+    """
+    endpoints = parse_mix(mix) if isinstance(mix, basestring) else mix
+    user_ids = list(user_ids)
+    if concurrency < 1 or requests < 1:
+        raise ValueError('At least one client and request are required')
+    if not user_ids:
+        raise ValueError('No users to request')
+
+    weights = []
+    total_weight = 0
+    for _, weight in endpoints:
+        total_weight += weight
+        weights.append(total_weight)
+
+    lock = threading.Lock()
+    pending = [requests]
+    samples = []
+
+    def client(rand):
+        """
+        Sends requests until all of them are done.
+        """
+        while True:
+            with lock:
+                if pending[0] <= 0:
+                    return
+                pending[0] -= 1
+
+            index = bisect.bisect_right(weights, rand.randrange(total_weight))
+            name = endpoints[index][0]
+            url = base_url + ENDPOINTS[name].format(rand.choice(user_ids))
+            started = timer()
+            try:
+                urllib2.urlopen(url, timeout=timeout).read()
+                failed = False
+            except Exception:  # pylint: disable=broad-except
+                # any failure (also dropped connection) is a failed request
+                log.debug('Request to %s failed', url, exc_info=True)
+                failed = True
+            latency = timer() - started
+
+            with lock:
+                samples.append((name, latency, failed))
+
+    rand = random.Random(seed)
+    clients = [
+        threading.Thread(target=client, args=(random.Random(rand.random()),))
+        for _ in xrange(concurrency)
+    ]
+    started = timer()
+    for thread in clients:
+        thread.start()
+    for thread in clients:
+        thread.join()
+    elapsed = timer() - started
+
+    results = {
+        name: summarize(
+            [sample for sample in samples if sample[0] == name], elapsed
+        )
+        for name, _ in endpoints
+    }
+    results['total'] = summarize(samples, elapsed, expected=requests)
+    return results
+
+
+def summarize(samples, elapsed, expected=None):
+    """
+    Calculates throughput, latency percentiles and error rate of samples.
+
+    Raises RuntimeError if fewer than `expected` samples were collected.
+    """
+    if expected is not None and len(samples) < expected:
+        raise RuntimeError(
+            'Only {0} of {1} requests were recorded'.format(
+                len(samples), expected
+            )
+        )
+    latencies = sorted(latency for _, latency, _ in samples)
+    errors = sum(1 for _, _, failed in samples if failed)
+    return {
+        'requests': len(samples),
+        'errors': errors,
+        'error_rate': float(errors) / len(samples) if samples else 0,
+        'throughput': len(samples) / elapsed if elapsed else 0,
+        'p50': percentile(latencies, 50),
+        'p95': percentile(latencies, 95),
+        'p99': percentile(latencies, 99),
+    }
+
+
+def format_report(results):
+    """
+    Formats load test results as a table.
+    """
+    lines = [
+        '{0:<20} {1:>8} {2:>8} {3:>9} {4:>9} {5:>9} {6:>9}'.format(
+            'endpoint', 'requests', 'req/s', 'p50 (ms)', 'p95 (ms)',
+            'p99 (ms)', 'errors %',
+        )
+    ]
+    for name in sorted(results, key=lambda name: (name == 'total', name)):
+        result = results[name]
+        lines.append(
+            '{0:<20} {1:>8} {2:>8.1f} {3:>9.1f} {4:>9.1f} {5:>9.1f} '
+            '{6:>9.2f}'.format(
+                name,
+                result['requests'],
+                result['throughput'],
+                result['p50'] * 1000,
+                result['p95'] * 1000,
+                result['p99'] * 1000,
+                result['error_rate'] * 100,
+            )
+        )
+    return '\n'.join(lines)
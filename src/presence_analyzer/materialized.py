@@ -0,0 +1,138 @@
+# -*- coding: utf-8 -*-
+"""
+Precomputed (materialized) views.
+"""
+
+import logging
+import os
+import shutil
+import tempfile
+from datetime import datetime
+
+import views  # pylint: disable=relative-import
+from utils import (  # pylint: disable=relative-import
+    build_version,
+    load_data,
+    precomputed_path,
+)
+
+log = logging.getLogger(__name__)  # pylint: disable=invalid-name
+
+USER_VIEWS = {
+    'mean_time_weekday': views.mean_time_weekday_view,
+    'presence_weekday': views.presence_weekday_view,
+}
+
+
+def build_views(views_dir, force=False, keep=2):
+    """
+    Precomputes bodies of all views for current data version.
+
+    Bodies are written to new directory named after data version and
+    build time, then `current` link in views directory is switched to it.
+    Version which is already built is only switched to unless forced.
+    Only `keep` most recent builds are left in views directory.
+    Returns name of the build.
+
+    It creates structure like this:
+    views_dir/
+        current -> 1380700800000-2048.20131001090000000000
+        1380700800000-2048.20131001090000000000/
+            users.json
+            mean_time_weekday/
+                10.json
+            presence_weekday/
+                10.json
+    """
+    store = load_data()
+    version = store['version']
+    if not os.path.isdir(views_dir):
+        os.makedirs(views_dir)
+
+    builds = sorted(
+        name for name in list_builds(views_dir)
+        if build_version(name) == version
+    )
+    if force or not builds:
+        build = '{0}.{1}'.format(
+            version, datetime.now().strftime('%Y%m%d%H%M%S%f')
+        )
+        build_dir = tempfile.mkdtemp(prefix='.build-', dir=views_dir)
+        try:
+            os.chmod(build_dir, 0755)
+            write_views(build_dir, store['data'].keys())
+            os.rename(build_dir, os.path.join(views_dir, build))
+        finally:
+            if os.path.exists(build_dir):
+                shutil.rmtree(build_dir)
+        log.info('Built views of %d users', len(store['data']))
+    else:
+        build = builds[-1]
+
+    switch_link(os.path.join(views_dir, 'current'), build)
+    prune_builds(views_dir, keep)
+    return build
+
+
+def list_builds(views_dir):
+    """
+    Returns names of complete builds in views directory.
+    """
+    return [
+        name for name in os.listdir(views_dir)
+        if not name.startswith('.') and
+        os.path.isdir(os.path.join(views_dir, name)) and
+        not os.path.islink(os.path.join(views_dir, name))
+    ]
+
+
+def write_views(views_dir, user_ids):
+    """
+    Writes bodies of all views computed from currently loaded data.
+    """
+    write_body(
+        precomputed_path(views_dir, 'users'),
+        views.users_view.compute(),
+    )
+    for name, view in USER_VIEWS.iteritems():
+        os.mkdir(os.path.join(views_dir, name))
+        for user_id in user_ids:
+            write_body(
+                precomputed_path(views_dir, name, user_id=user_id),
+                view.compute(user_id=user_id),
+            )
+
+
+def write_body(path, response):
+    """
+    Writes body of response to file.
+    """
+    with open(path, 'wb') as body:
+        body.write(response.data)
+
+
+def switch_link(path, target):
+    """
+    Atomically points symbolic link to target.
+    """
+    tmp_path = '{0}.{1}'.format(path, os.getpid())
+    if os.path.lexists(tmp_path):
+        os.remove(tmp_path)
+    os.symlink(target, tmp_path)
+    os.rename(tmp_path, path)
+
+
+def prune_builds(views_dir, keep):
+    """
+    Removes all but `keep` most recent builds of views, ordered by build
+    time in their names. Current build is never removed.
+    """
+    current = os.readlink(os.path.join(views_dir, 'current'))
+    builds = sorted(
+        (name for name in list_builds(views_dir) if name != current),
+        key=lambda name: name.partition('.')[2],
+        reverse=True,
+    )
+    for name in builds[max(keep - 1, 0):]:
+        log.debug('Removing views build %s', name)
+        shutil.rmtree(os.path.join(views_dir, name))
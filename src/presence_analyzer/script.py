@@ -26,17 +26,36 @@ del _buildout_path
 
 
 # bin/paster serve parts/etc/deploy.ini
-def make_app(global_conf={}, config=DEPLOY_CFG, debug=False):
+def make_app(global_conf={}, config=DEPLOY_CFG, debug=False,
+             eager_load=False):
+    """Create the application.
+
+    With 'eager_load' (or EAGER_LOAD in config) presence data is parsed
+    and indexed before the server starts accepting requests, otherwise
+    it is loaded by the first request (or readiness check).
+    """
+    from paste.deploy.converters import asbool
     from presence_analyzer import app
+    from presence_analyzer.utils import load_data
     app.config.from_pyfile(abspath(config))
     app.debug = debug
+    app.config['EAGER_LOAD'] = (
+        asbool(eager_load) or app.config.get('EAGER_LOAD', False)
+    )
+    if app.config['EAGER_LOAD']:
+        load_data()
     return app
 
 
 # bin/paster serve parts/etc/debug.ini
 def make_debug(global_conf={}, **conf):
     from werkzeug.debug import DebuggedApplication
-    app = make_app(global_conf, config=DEBUG_CFG, debug=True)
+    app = make_app(
+        global_conf,
+        config=DEBUG_CFG,
+        debug=True,
+        eager_load=conf.get('eager_load', False),
+    )
     return DebuggedApplication(app, evalex=True)
 
 
@@ -78,6 +97,91 @@ def _serve(action, debug=False, dry_run=False):
     paste.script.command.run()
 
 
+def _server_options():
+    """Threadpool settings of deployment server, as in deploy.ini."""
+    from ConfigParser import RawConfigParser
+    options = {'workers': 50, 'spawn_if_under': 5, 'max_requests': 200}
+    parser = RawConfigParser()
+    if parser.read(abspath(DEPLOY_INI)):
+        for key in options:
+            option = 'threadpool_' + key
+            if parser.has_option('server:main', option):
+                options[key] = parser.getint('server:main', option)
+    return options
+
+
+def _loadtest(concurrency, requests, mix, users, days, workers,
+              spawn_if_under, max_requests, seed):
+    """Serve the application against generated data and load test it.
+
+    Negative threadpool settings are read from deploy.ini.
+    """
+    import shutil
+    import tempfile
+    from presence_analyzer import app
+    from presence_analyzer import loadtest
+    from presence_analyzer.utils import load_data
+
+    if concurrency < 1:
+        werkzeug.script.fail('--concurrency must be at least 1')
+    if requests < 1:
+        werkzeug.script.fail('--requests must be at least 1')
+    if users < 1:
+        werkzeug.script.fail('--users must be at least 1')
+    try:
+        endpoints = loadtest.parse_mix(mix)
+    except ValueError as error:
+        werkzeug.script.fail('Invalid --mix: %s' % error)
+
+    server_options = _server_options()
+    if workers < 0:
+        workers = server_options['workers']
+    if spawn_if_under < 0:
+        spawn_if_under = server_options['spawn_if_under']
+    if max_requests < 0:
+        max_requests = server_options['max_requests']
+
+    tmpdir = tempfile.mkdtemp(prefix='presence_analyzer-')
+    try:
+        data_csv = os.path.join(tmpdir, 'data.csv')
+        rows = loadtest.generate_data(data_csv, users, days, seed)
+        if not rows:
+            werkzeug.script.fail('No presence data generated, use more --days')
+        app.config['DATA_CSV'] = data_csv
+        store = load_data()
+        print 'Generated %d rows of %d users, loaded in %.3fs' % (
+            rows, users, store['duration'])
+
+        process, address = loadtest.serve_process(
+            app,
+            workers=workers,
+            spawn_if_under=spawn_if_under,
+            max_requests=max_requests,
+        )
+        base_url = 'http://%s:%d' % address
+        print 'Serving on %s in process %d (workers=%d, ' \
+            'spawn_if_under=%d, max_requests=%d)' % (
+                base_url, process.pid, workers, spawn_if_under,
+                max_requests)
+        print 'Sending %d requests from %d clients (%s)' % (
+            requests, concurrency, mix)
+        try:
+            results = loadtest.run_loadtest(
+                base_url,
+                store['data'].keys(),
+                mix=endpoints,
+                concurrency=concurrency,
+                requests=requests,
+                seed=seed,
+            )
+        finally:
+            process.terminate()
+            process.join()
+        print loadtest.format_report(results)
+    finally:
+        shutil.rmtree(tmpdir)
+
+
 # bin/flask-ctl ...
 def run():
     action_shell = werkzeug.script.make_shell(make_shell, make_shell.__doc__)
@@ -110,4 +214,52 @@ def run():
         """Stop the application."""
         _serve('stop', dry_run=dry_run)
 
-    werkzeug.script.run()
+    from presence_analyzer.loadtest import DEFAULT_MIX
+
+    # bin/flask-ctl loadtest
+    def action_loadtest(concurrency=('c', 10), requests=('n', 1000),
+                        mix=('m', DEFAULT_MIX), users=100, days=250,
+                        workers=-1, spawn_if_under=-1, max_requests=-1,
+                        seed=0):
+        """Load test the application served by threadpool server.
+
+        Serves the application in a child process against generated data
+        and sends requests to the API from threads of this process.
+        Throughput of many clients may be limited by the client process
+        itself.
+
+        Options:
+         - '--concurrency' number of concurrent clients
+         - '--requests' total number of requests
+         - '--mix' endpoints with weights, e.g. 'users:1,presence_weekday:3'
+         - '--users' and '--days' size of generated data
+         - '--workers', '--spawn-if-under', '--max-requests' threadpool
+           settings, by default (-1) read from deploy.ini
+         - '--seed' random seed of generated data and requests
+        """
+        _loadtest(concurrency, requests, mix, users, days, workers,
+                  spawn_if_under, max_requests, seed)
+
+    # bin/flask-ctl build-views
+    def action_build_views(debug=False, force=False):
+        """Precompute bodies of API views for current data.
+
+        Bodies are written to VIEWS_DIR and served instead of computing
+        views as long as data file doesn't change.
+
+        Options:
+         - '--debug' use debugging configuration
+         - '--force' rebuild views of already built data version
+        """
+        from presence_analyzer.materialized import build_views
+        from presence_analyzer.utils import build_version
+        app = make_app(config=DEBUG_CFG if debug else DEPLOY_CFG)
+        views_dir = app.config['VIEWS_DIR']
+        build = build_views(views_dir, force=force)
+        print 'Views of data version %s are in %s' % (
+            build_version(build), os.path.join(views_dir, build))
+
+    # werkzeug.script names actions after functions
+    namespace = dict(locals())
+    namespace['action_build-views'] = namespace.pop('action_build_views')
+    werkzeug.script.run(namespace)
@@ -4,10 +4,16 @@ Presence analyzer unit tests.
 """
 import json
 import os.path
+import shutil
+import socket
+import tempfile
+import threading
 import unittest
 from datetime import date, time, timedelta
 
+import loadtest  # pylint: disable=relative-import
 import main  # pylint: disable=relative-import
+import materialized  # pylint: disable=relative-import
 import utils  # pylint: disable=relative-import
 import views  # pylint: disable=relative-import
 
@@ -34,7 +40,7 @@ class PresenceAnalyzerViewsTestCase(unittest.TestCase):
         """
         Get rid of unused objects after each test.
         """
-        pass
+        main.app.config.pop('EAGER_LOAD', None)
 
     def test_mainpage(self):
         """
@@ -46,6 +52,57 @@ class PresenceAnalyzerViewsTestCase(unittest.TestCase):
 
         assert resp.headers['Location'].endswith('/presence_weekday.html')
 
+    def test_healthz(self):
+        """
+        Test liveness check.
+        """
+        resp = self.client.get('/healthz')
+
+        self.assertEqual(resp.status_code, 200)
+        self.assertDictEqual(json.loads(resp.data), {'status': 'ok'})
+
+    def test_readyz(self):
+        """
+        Test readiness check before and after eager load of data.
+        """
+        main.app.config.update({'EAGER_LOAD': True})
+        utils._cache.clear()  # pylint: disable=protected-access
+        resp = self.client.get('/readyz')
+
+        self.assertEqual(resp.status_code, 503)
+        self.assertFalse(json.loads(resp.data)['ready'])
+
+        utils.load_data()
+        resp = self.client.get('/readyz')
+        data = json.loads(resp.data)
+
+        self.assertEqual(resp.status_code, 200)
+        self.assertTrue(data['ready'])
+        self.assertFalse(data['stale'])
+        self.assertEqual(data['version'], utils.data_version(TEST_DATA_CSV))
+        self.assertEqual(data['rows'], 9)
+        self.assertGreaterEqual(data['load_duration'], 0)
+
+    def test_readyz_lazy(self):
+        """
+        Test readiness check loads data without eager load.
+        """
+        main.app.config.update({'EAGER_LOAD': False})
+        utils._cache.clear()  # pylint: disable=protected-access
+        resp = self.client.get('/readyz')
+        data = json.loads(resp.data)
+
+        self.assertEqual(resp.status_code, 200)
+        self.assertTrue(data['ready'])
+        self.assertEqual(data['version'], utils.data_version(TEST_DATA_CSV))
+        self.assertEqual(data['rows'], 9)
+
+        main.app.config.update({'DATA_CSV': TEST_DATA_CSV + '.missing'})
+        resp = self.client.get('/readyz')
+
+        self.assertEqual(resp.status_code, 503)
+        self.assertFalse(json.loads(resp.data)['ready'])
+
     def test_api_users(self):
         """
         Test users listing.
@@ -107,6 +164,50 @@ class PresenceAnalyzerViewsTestCase(unittest.TestCase):
             }
         )
 
+    def test_top_view(self):
+        """
+        Test rankings of users.
+        """
+        resp = self.client.get('/api/v1/top/presence')
+        data = json.loads(resp.data)
+
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(resp.content_type, 'application/json')
+        self.assertEqual(data, [
+            {'user_id': 11, 'name': 'User 11', 'value': 118402},
+            {'user_id': 10, 'name': 'User 10', 'value': 78217},
+        ])
+
+        resp = self.client.get(
+            '/api/v1/top/presence?n=1&from=2013-09-10&to=2013-09-12'
+        )
+        self.assertEqual(json.loads(resp.data), [
+            {'user_id': 10, 'name': 'User 10', 'value': 78217},
+        ])
+
+        resp = self.client.get('/api/v1/top/earliest_arrival?n=1')
+        self.assertEqual(json.loads(resp.data)[0]['user_id'], 10)
+        self.assertAlmostEqual(json.loads(resp.data)[0]['value'], 35754.33, 2)
+
+        resp = self.client.get('/api/v1/top/latest_departure?from=2013-09-13')
+        self.assertEqual(json.loads(resp.data), [
+            {'user_id': 11, 'name': 'User 11', 'value': 54242},
+        ])
+
+        resp = self.client.get('/api/v1/top/presence?to=2013-01-01')
+        self.assertEqual(json.loads(resp.data), [])
+
+    def test_top_view_errors(self):
+        """
+        Test rankings of unknown metric and with invalid parameters.
+        """
+        resp = self.client.get('/api/v1/top/unknown')
+        self.assertEqual(resp.status_code, 404)
+
+        for query in ['n=0', 'n=x', 'from=2013-13-01', 'to=yesterday']:
+            resp = self.client.get('/api/v1/top/presence?' + query)
+            self.assertEqual(resp.status_code, 400)
+
 
 class PresenceAnalyzerUtilsTestCase(unittest.TestCase):
     """
@@ -141,6 +242,102 @@ class PresenceAnalyzerUtilsTestCase(unittest.TestCase):
             time(9, 39, 5)
         )
 
+    def test_parse_data(self):
+        """
+        Test parsing of CSV file skips invalid lines.
+        """
+        tmpdir = tempfile.mkdtemp()
+        data_csv = os.path.join(tmpdir, 'data.csv')
+        try:
+            with open(data_csv, 'w') as data:
+                data.write(
+                    'user_id,date,start,end\n'
+                    '10,2013-09-10,09:39:05,17:59:52\n'
+                    '10,2013-09-11,9 am,16:07:37\n'
+                    '11,2013-09-12,10:48:46,17:23:51\n'
+                )
+            data, rows = utils.parse_data(data_csv)
+        finally:
+            shutil.rmtree(tmpdir)
+
+        self.assertEqual(rows, 2)
+        self.assertItemsEqual(data[10].keys(), [date(2013, 9, 10)])
+        self.assertItemsEqual(data[11].keys(), [date(2013, 9, 12)])
+
+    def test_load_data(self):
+        """
+        Test loading data is done once per data version.
+        """
+        utils._cache.clear()  # pylint: disable=protected-access
+        store = utils.load_data()
+
+        self.assertEqual(store['path'], TEST_DATA_CSV)
+        self.assertEqual(store['version'], utils.data_version(TEST_DATA_CSV))
+        self.assertEqual(store['rows'], 9)
+        self.assertItemsEqual(store['weekdays'].keys(), [10, 11])
+        self.assertIs(utils.load_data(), store)
+        self.assertIsNot(utils.load_data(force=True), store)
+
+    def test_aggregate_period(self):
+        """
+        Test summing presence of user in period.
+        """
+        totals = utils.build_aggregates(utils.get_data())[10]
+
+        self.assertEqual(
+            utils.aggregate_period(totals),
+            (3, 78217, 107263, 185480),
+        )
+        self.assertEqual(
+            utils.aggregate_period(
+                totals, date(2013, 9, 11), date(2013, 9, 11)
+            ),
+            (1, 24465, 33592, 58057),
+        )
+        self.assertEqual(
+            utils.aggregate_period(totals, start=date(2013, 9, 11)),
+            (2, 48170, 72518, 120688),
+        )
+        self.assertEqual(
+            utils.aggregate_period(totals, end=date(2013, 9, 9)),
+            (0, 0, 0, 0),
+        )
+
+    def test_top_users(self):
+        """
+        Test rankings are cached until data changes.
+        """
+        utils._cache.clear()  # pylint: disable=protected-access
+        result = utils.top_users('presence', 1)
+
+        self.assertEqual([user['user_id'] for user in result], [11])
+        self.assertIs(utils.top_users('presence', 1), result)
+        self.assertIsNot(utils.top_users('presence', 2), result)
+
+        utils.load_data(force=True)
+        self.assertIsNot(utils.top_users('presence', 1), result)
+
+    def test_top_users_ties(self):
+        """
+        Test users with equal values are ranked by user id in every metric.
+        """
+        tmpdir = tempfile.mkdtemp()
+        data_csv = os.path.join(tmpdir, 'data.csv')
+        try:
+            with open(data_csv, 'w') as data:
+                for user_id in (12, 7, 9):
+                    data.write(
+                        '{0},2013-09-10,09:00:00,17:00:00\n'.format(user_id)
+                    )
+            main.app.config.update({'DATA_CSV': data_csv})
+            for metric in utils.TOP_METRICS:
+                self.assertEqual(
+                    [user['user_id'] for user in utils.top_users(metric, 2)],
+                    [7, 9],
+                )
+        finally:
+            shutil.rmtree(tmpdir)
+
     def test_group_by_weekday(self):
         """
         Test groups entries by weekdays.
@@ -211,6 +408,357 @@ class PresenceAnalyzerUtilsTestCase(unittest.TestCase):
         self.assertEqual(utils.mean([1, 99]), 50)
 
 
+class PresenceAnalyzerMaterializedTestCase(unittest.TestCase):
+    """
+    Precomputed views tests.
+    """
+
+    def setUp(self):
+        """
+        Before each test, set up a environment.
+        """
+        self.tmpdir = tempfile.mkdtemp()
+        self.data_csv = os.path.join(self.tmpdir, 'data.csv')
+        self.views_dir = os.path.join(self.tmpdir, 'views')
+        shutil.copy(TEST_DATA_CSV, self.data_csv)
+        main.app.config.update({
+            'DATA_CSV': self.data_csv,
+            'VIEWS_DIR': self.views_dir,
+        })
+        self.client = main.app.test_client()
+
+    def tearDown(self):
+        """
+        Get rid of unused objects after each test.
+        """
+        del main.app.config['VIEWS_DIR']
+        shutil.rmtree(self.tmpdir)
+
+    def tamper(self, build, path, body):
+        """
+        Replaces precomputed view body.
+        """
+        with open(os.path.join(self.views_dir, build, path), 'w') as view:
+            view.write(body)
+
+    def test_build_views(self):
+        """
+        Test precomputing bodies of all views.
+        """
+        build = materialized.build_views(self.views_dir)
+
+        self.assertEqual(
+            utils.build_version(build), utils.data_version(self.data_csv)
+        )
+        self.assertEqual(
+            os.readlink(os.path.join(self.views_dir, 'current')), build
+        )
+        for url, path in [
+                ('/api/v1/users', 'users.json'),
+                ('/api/v1/mean_time_weekday/10', 'mean_time_weekday/10.json'),
+                ('/api/v1/presence_weekday/11', 'presence_weekday/11.json'),
+        ]:
+            with open(os.path.join(self.views_dir, build, path)) as view:
+                self.assertEqual(view.read(), self.client.get(url).data)
+
+    def test_serve_precomputed(self):
+        """
+        Test serving precomputed bodies of current data version only.
+        """
+        build = materialized.build_views(self.views_dir)
+        self.tamper(build, 'presence_weekday/11.json', '[]')
+        utils._cache.clear()  # pylint: disable=protected-access
+
+        resp = self.client.get('/api/v1/presence_weekday/11')
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(resp.content_type, 'application/json')
+        self.assertEqual(json.loads(resp.data), [])
+        # serving precomputed body doesn't load data
+        cache = utils._cache  # pylint: disable=protected-access
+        self.assertNotIn('store', cache)
+
+        resp = self.client.get('/api/v1/presence_weekday/0')
+        self.assertEqual(resp.status_code, 404)
+
+        with open(self.data_csv, 'a') as data:
+            data.write('\n12,2013-09-10,09:00:00,17:00:00\n')
+        resp = self.client.get('/api/v1/presence_weekday/11')
+        self.assertEqual(len(json.loads(resp.data)), 8)
+
+    def test_rebuild_views(self):
+        """
+        Test rebuilding views and removing old builds.
+        """
+        build = materialized.build_views(self.views_dir)
+        self.tamper(build, 'users.json', '[]')
+
+        self.assertEqual(materialized.build_views(self.views_dir), build)
+        self.assertEqual(self.client.get('/api/v1/users').data, '[]')
+
+        forced = materialized.build_views(self.views_dir, force=True)
+        self.assertNotEqual(forced, build)
+        self.assertEqual(
+            utils.build_version(forced), utils.build_version(build)
+        )
+        self.assertEqual(
+            os.readlink(os.path.join(self.views_dir, 'current')), forced
+        )
+        self.assertEqual(len(json.loads(
+            self.client.get('/api/v1/users').data
+        )), 2)
+        # previous build is left intact
+        with open(os.path.join(self.views_dir, build, 'users.json')) as view:
+            self.assertEqual(view.read(), '[]')
+
+        builds = []
+        for user_id in (12, 13):
+            with open(self.data_csv, 'a') as data:
+                data.write('\n{0},2013-09-10,09:00:00,17:00:00\n'.format(
+                    user_id
+                ))
+            builds.append(materialized.build_views(self.views_dir))
+
+        self.assertItemsEqual(
+            os.listdir(self.views_dir), ['current'] + builds
+        )
+        self.assertEqual(len(json.loads(
+            self.client.get('/api/v1/users').data
+        )), 4)
+
+
+    def test_prune_builds(self):
+        """
+        Test removing old builds by build time in their names.
+        """
+        builds = [
+            '1-2.20130901000000000000',
+            '1-2.20130902000000000000',
+            '3-4.20130903000000000000',
+        ]
+        for mtime, build in zip([300, 100, 200], builds):
+            os.makedirs(os.path.join(self.views_dir, build))
+            os.utime(os.path.join(self.views_dir, build), (mtime, mtime))
+        materialized.switch_link(
+            os.path.join(self.views_dir, 'current'), builds[2]
+        )
+        materialized.prune_builds(self.views_dir, 2)
+
+        self.assertItemsEqual(
+            os.listdir(self.views_dir), ['current'] + builds[1:]
+        )
+
+
+class PresenceAnalyzerLoadtestTestCase(unittest.TestCase):
+    """
+    Load testing utilities tests.
+    """
+
+    def setUp(self):
+        """
+        Before each test, set up a environment.
+        """
+        self.tmpdir = tempfile.mkdtemp()
+        main.app.config.update({'DATA_CSV': TEST_DATA_CSV})
+
+    def tearDown(self):
+        """
+        Get rid of unused objects after each test.
+        """
+        shutil.rmtree(self.tmpdir)
+
+    def test_generate_data(self):
+        """
+        Test generating random presence data.
+        """
+        data_csv = os.path.join(self.tmpdir, 'data.csv')
+        rows = loadtest.generate_data(data_csv, users=3, days=30, seed=1)
+        main.app.config.update({'DATA_CSV': data_csv})
+        data = utils.get_data()
+
+        self.assertItemsEqual(data.keys(), [10, 11, 12])
+        self.assertEqual(sum(len(items) for items in data.values()), rows)
+        for items in data.values():
+            for day, entry in items.items():
+                self.assertLess(day.weekday(), 5)
+                self.assertGreater(utils.interval(**entry), 0)
+
+    def test_parse_mix(self):
+        """
+        Test parsing request mix.
+        """
+        mix = 'users:1, presence_weekday:3,mean_time_weekday'
+        self.assertEqual(
+            loadtest.parse_mix(mix),
+            [('users', 1), ('presence_weekday', 3), ('mean_time_weekday', 1)],
+        )
+        self.assertRaises(ValueError, loadtest.parse_mix, 'unknown:1')
+        self.assertRaises(ValueError, loadtest.parse_mix, 'users:0')
+        self.assertRaises(ValueError, loadtest.parse_mix, 'users:-1')
+
+    def test_percentile(self):
+        """
+        Test percentile of sorted values.
+        """
+        values = range(1, 101)
+        self.assertEqual(loadtest.percentile(values, 50), 50)
+        self.assertEqual(loadtest.percentile(values, 95), 95)
+        self.assertEqual(loadtest.percentile(values, 99), 99)
+        self.assertEqual(loadtest.percentile(values, 100), 100)
+        self.assertEqual(loadtest.percentile([7], 99), 7)
+        self.assertEqual(loadtest.percentile([], 50), 0)
+
+    def test_serve(self):
+        """
+        Test sending requests to application served by threadpool server.
+        """
+        server = loadtest.serve(
+            main.app, workers=3, spawn_if_under=2, max_requests=7
+        )
+        try:
+            self.assertEqual(server.thread_pool.nworkers, 3)
+            self.assertEqual(server.thread_pool.spawn_if_under, 2)
+            self.assertEqual(server.thread_pool.max_requests, 7)
+
+            base_url = 'http://{0}:{1}'.format(*server.server_address)
+            results = loadtest.run_loadtest(
+                base_url,
+                [10, 11],
+                mix='users:1,presence_weekday:1,top:1',
+                concurrency=2,
+                requests=30,
+                seed=1,
+            )
+            # there is no user 12 in test data
+            missing = loadtest.run_loadtest(
+                base_url,
+                [12],
+                mix='presence_weekday:1',
+                concurrency=2,
+                requests=10,
+            )
+        finally:
+            loadtest.shutdown(server)
+
+        self.assertFalse(server.thread.is_alive())
+        self.assertItemsEqual(
+            results.keys(), ['users', 'presence_weekday', 'top', 'total']
+        )
+        self.assertEqual(results['total']['requests'], 30)
+        self.assertEqual(
+            results['users']['requests'] +
+            results['presence_weekday']['requests'] +
+            results['top']['requests'],
+            30
+        )
+        self.assertGreater(results['top']['requests'], 0)
+        self.assertEqual(results['total']['errors'], 0)
+        self.assertGreater(results['total']['throughput'], 0)
+        self.assertLessEqual(
+            results['total']['p50'], results['total']['p99']
+        )
+        self.assertEqual(missing['total']['errors'], 10)
+        self.assertEqual(missing['total']['error_rate'], 1)
+
+    def test_run_loadtest_dropped_connections(self):
+        """
+        Test requests to server dropping connections are counted as errors.
+        """
+        listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        listener.bind(('127.0.0.1', 0))
+        listener.listen(5)
+
+        def drop_connections():
+            """
+            Accepts connections and closes them without response.
+            """
+            while True:
+                try:
+                    connection, _ = listener.accept()
+                except socket.error:
+                    return
+                connection.recv(1024)
+                connection.close()
+
+        thread = threading.Thread(target=drop_connections)
+        thread.daemon = True
+        thread.start()
+        try:
+            results = loadtest.run_loadtest(
+                'http://127.0.0.1:{0}'.format(listener.getsockname()[1]),
+                [10],
+                mix='users:1',
+                concurrency=2,
+                requests=10,
+            )
+        finally:
+            listener.close()
+
+        self.assertEqual(results['total']['requests'], 10)
+        self.assertEqual(results['total']['errors'], 10)
+        self.assertEqual(results['total']['error_rate'], 1)
+
+    def test_run_loadtest_invalid(self):
+        """
+        Test load test without users, clients or requests.
+        """
+        url = 'http://127.0.0.1:1'
+        self.assertRaises(ValueError, loadtest.run_loadtest, url, [])
+        self.assertRaises(
+            ValueError, loadtest.run_loadtest, url, [10], concurrency=0
+        )
+        self.assertRaises(
+            ValueError, loadtest.run_loadtest, url, [10], requests=0
+        )
+        self.assertRaises(
+            ValueError, loadtest.run_loadtest, url, [10], mix='bogus:1'
+        )
+
+    def test_summarize(self):
+        """
+        Test summarizing samples fails when some requests are missing.
+        """
+        samples = [('users', 0.1, False), ('users', 0.3, True)]
+        result = loadtest.summarize(samples, 2.0, expected=2)
+
+        self.assertEqual(result['requests'], 2)
+        self.assertEqual(result['errors'], 1)
+        self.assertEqual(result['error_rate'], 0.5)
+        self.assertEqual(result['throughput'], 1)
+        self.assertEqual(result['p50'], 0.1)
+        self.assertEqual(result['p99'], 0.3)
+        self.assertRaises(
+            RuntimeError, loadtest.summarize, samples, 2.0, expected=3
+        )
+
+    def test_serve_process(self):
+        """
+        Test serving application in child process.
+        """
+        process, address = loadtest.serve_process(
+            main.app, workers=2, spawn_if_under=1
+        )
+        try:
+            results = loadtest.run_loadtest(
+                'http://{0}:{1}'.format(*address),
+                [10, 11],
+                mix='mean_time_weekday:1',
+                concurrency=2,
+                requests=10,
+            )
+        finally:
+            process.terminate()
+            process.join()
+
+        self.assertFalse(process.is_alive())
+        self.assertEqual(results['total']['requests'], 10)
+        self.assertEqual(results['total']['errors'], 0)
+
+        self.assertRaises(
+            RuntimeError,
+            loadtest.serve_process, main.app, workers=2, spawn_if_under=5
+        )
+
+
 def suite():
     """
     Default test suite.
@@ -218,6 +766,10 @@ def suite():
     base_suite = unittest.TestSuite()
     base_suite.addTest(unittest.makeSuite(PresenceAnalyzerViewsTestCase))
     base_suite.addTest(unittest.makeSuite(PresenceAnalyzerUtilsTestCase))
+    base_suite.addTest(
+        unittest.makeSuite(PresenceAnalyzerMaterializedTestCase)
+    )
+    base_suite.addTest(unittest.makeSuite(PresenceAnalyzerLoadtestTestCase))
     return base_suite
 
 
@@ -3,11 +3,16 @@
 Helper functions used in views.
 """
 
+import bisect
 import csv
+import heapq
 import logging
+import os
+import threading
 from datetime import datetime
 from functools import wraps
 from json import dumps
+from timeit import default_timer as timer
 
 from flask import Response
 
@@ -15,6 +20,32 @@ from main import app  # pylint: disable=relative-import
 
 log = logging.getLogger(__name__)  # pylint: disable=invalid-name
 
+# Currently loaded data with its derived indexes, see load_data().
+_cache = {}  # pylint: disable=invalid-name
+_cache_lock = threading.Lock()  # pylint: disable=invalid-name
+
+# Maximum number of cached rankings of single data version.
+TOP_CACHE_SIZE = 1000
+
+# Rankings of users, metric: (descending order, value function).
+# Value is calculated from number of days, total presence time and sums
+# of arrival and departure times (seconds since midnight) in period.
+# All values are in seconds, ties are ranked by user id.
+TOP_METRICS = {
+    'presence': (
+        True,
+        lambda days, presence, arrivals, departures: presence,
+    ),
+    'earliest_arrival': (
+        False,
+        lambda days, presence, arrivals, departures: float(arrivals) / days,
+    ),
+    'latest_departure': (
+        True,
+        lambda days, presence, arrivals, departures: float(departures) / days,
+    ),
+}
+
 
 def jsonify(function):
     """
@@ -32,26 +63,86 @@ def jsonify(function):
     return inner
 
 
-def get_data():
+def precomputed(name):
+    """
+    Serves body of wrapped view precomputed by build_views() if it matches
+    current data version, otherwise computes it.
+
+    Wrapped function is available as `compute` attribute of the view.
+    """
+    def decorator(function):
+        """
+        Wraps view function to serve its precomputed body.
+        """
+        @wraps(function)
+        def inner(*args, **kwargs):
+            """
+            This docstring will be overridden by @wraps decorator.
+            """
+            body = get_precomputed(name, **kwargs)
+            if body is None:
+                return function(*args, **kwargs)
+            return Response(body, mimetype='application/json')
+        inner.compute = function
+        return inner
+    return decorator
+
+
+def precomputed_path(views_dir, name, **kwargs):
+    """
+    Returns path of precomputed view body in directory of views.
+    """
+    parts = [name] + [str(kwargs[key]) for key in sorted(kwargs)]
+    return os.path.join(views_dir, *parts) + '.json'
+
+
+def build_version(build):
+    """
+    Returns data version of views build named like '<version>.<build id>'.
+    """
+    return build.partition('.')[0]
+
+
+def get_precomputed(name, **kwargs):
+    """
+    Returns precomputed view body for current data version.
+    Returns None if there is no such body.
+
+    Data itself isn't loaded, only version of data file is checked.
+    """
+    views_dir = app.config.get('VIEWS_DIR')
+    if not views_dir:
+        return None
+
+    try:
+        build = os.readlink(os.path.join(views_dir, 'current'))
+        if build_version(build) != data_version(app.config['DATA_CSV']):
+            return None
+        with open(precomputed_path(
+                os.path.join(views_dir, build), name, **kwargs
+        ), 'rb') as body:
+            return body.read()
+    except (IOError, OSError):
+        return None
+
+
+def data_version(path):
+    """
+    Returns version of data file based on its modification time and size.
+    """
+    stat = os.stat(path)
+    return '{0}-{1}'.format(int(stat.st_mtime * 1000), stat.st_size)
+
+
+def parse_data(path):
     """
     Extracts presence data from CSV file and groups it by user_id.
 
-    It creates structure like this:
-    data = {
-        'user_id': {
-            datetime.date(2013, 10, 1): {
-                'start': datetime.time(9, 0, 0),
-                'end': datetime.time(17, 30, 0),
-            },
-            datetime.date(2013, 10, 2): {
-                'start': datetime.time(8, 30, 0),
-                'end': datetime.time(16, 45, 0),
-            },
-        }
-    }
+    Returns parsed data (see get_data()) and number of parsed rows.
     """
     data = {}
-    with open(app.config['DATA_CSV'], 'r') as csvfile:
+    rows = 0
+    with open(path, 'r') as csvfile:
         presence_reader = csv.reader(csvfile, delimiter=',')
         for i, row in enumerate(presence_reader):
             if len(row) != 4:
@@ -65,10 +156,228 @@ def get_data():
                 end = datetime.strptime(row[3], '%H:%M:%S').time()
             except (ValueError, TypeError):
                 log.debug('Problem with line %d: ', i, exc_info=True)
+                continue
 
             data.setdefault(user_id, {})[date] = {'start': start, 'end': end}
+            rows += 1
+
+    return data, rows
+
+
+def load_data(force=False):
+    """
+    Loads presence data and builds derived indexes.
+
+    Data is parsed again only when configured file has changed since last
+    load (or when forced), otherwise currently loaded data is returned.
+    It creates structure like this:
+    store = {
+        'path': '/path/to/data.csv',
+        'version': '1380700800000-2048',
+        'rows': 8,
+        'duration': 0.002,
+        'loaded_at': datetime.datetime(2013, 10, 1, 9, 0, 0),
+        'data': {...},  # see get_data()
+        'weekdays': {
+            'user_id': [[24123], [16564], [], [], [], [], []],
+        },
+        'aggregates': {...},  # see build_aggregates()
+        'top': {},  # cached rankings, see top_users()
+    }
+    """
+    path = app.config['DATA_CSV']
+    version = data_version(path)
+    store = _cache.get('store')
+    if not force and is_current(store, path, version):
+        return store
+
+    with _cache_lock:
+        store = _cache.get('store')
+        if not force and is_current(store, path, version):
+            return store
+
+        started = timer()
+        data, rows = parse_data(path)
+        store = {
+            'path': path,
+            'version': version,
+            'rows': rows,
+            'data': data,
+            'weekdays': dict(
+                (user_id, group_by_weekday(items))
+                for user_id, items in data.iteritems()
+            ),
+            'aggregates': build_aggregates(data),
+            'top': {},
+        }
+        store['duration'] = timer() - started
+        store['loaded_at'] = datetime.now()
+        _cache['store'] = store
+        log.info(
+            'Loaded %d rows of %s (version %s) in %.3fs',
+            rows, path, version, store['duration'],
+        )
+    return store
+
 
-    return data
+def build_aggregates(data):
+    """
+    Builds running totals of presence of every user ordered by date.
+
+    Totals of any period are differences of two running totals.
+    It creates structure like this:
+    aggregates = {
+        'user_id': {
+            'dates': [datetime.date(2013, 10, 1), datetime.date(2013, 10, 2)],
+            'presence': [0, 30600, 59100],
+            'arrivals': [0, 32400, 63000],
+            'departures': [0, 63000, 123300],
+        },
+    }
+    """
+    aggregates = {}
+    for user_id, items in data.iteritems():
+        totals = {
+            'dates': sorted(items),
+            'presence': [0],
+            'arrivals': [0],
+            'departures': [0],
+        }
+        for date in totals['dates']:
+            start = seconds_since_midnight(items[date]['start'])
+            end = seconds_since_midnight(items[date]['end'])
+            totals['presence'].append(totals['presence'][-1] + end - start)
+            totals['arrivals'].append(totals['arrivals'][-1] + start)
+            totals['departures'].append(totals['departures'][-1] + end)
+        aggregates[user_id] = totals
+    return aggregates
+
+
+def aggregate_period(totals, start=None, end=None):
+    """
+    Sums presence of user between two dates (inclusive).
+
+    Returns number of days, total presence time and sums of arrival and
+    departure times.
+    """
+    dates = totals['dates']
+    first = bisect.bisect_left(dates, start) if start else 0
+    last = bisect.bisect_right(dates, end) if end else len(dates)
+    if last <= first:
+        return 0, 0, 0, 0
+    return (
+        last - first,
+        totals['presence'][last] - totals['presence'][first],
+        totals['arrivals'][last] - totals['arrivals'][first],
+        totals['departures'][last] - totals['departures'][first],
+    )
+
+
+def top_users(metric, count, start=None, end=None):
+    """
+    Ranks users present between two dates (inclusive) by given metric,
+    see TOP_METRICS. Returns at most `count` best users.
+
+    Rankings are cached until data changes.
+    """
+    store = load_data()
+    key = (metric, count, start, end)
+    if key in store['top']:
+        return store['top'][key]
+
+    descending, value = TOP_METRICS[metric]
+    ranking = []
+    for user_id, totals in store['aggregates'].iteritems():
+        period = aggregate_period(totals, start, end)
+        if period[0]:
+            user_value = value(*period)
+            ranking.append((
+                -user_value if descending else user_value,
+                user_id,
+                user_value,
+            ))
+
+    result = [
+        {
+            'user_id': user_id,
+            'name': 'User {0}'.format(user_id),
+            'value': user_value,
+        }
+        for _, user_id, user_value in heapq.nsmallest(count, ranking)
+    ]
+    if len(store['top']) >= TOP_CACHE_SIZE:
+        store['top'].clear()
+    store['top'][key] = result
+    return result
+
+
+def is_current(store, path, version):
+    """
+    Checks if loaded data matches given data file and its version.
+    """
+    return (
+        store is not None and
+        store['path'] == path and
+        store['version'] == version
+    )
+
+
+def data_status():
+    """
+    Describes state of loaded data for health checks.
+    """
+    store = _cache.get('store')
+    if store is None or store['path'] != app.config.get('DATA_CSV'):
+        return {
+            'ready': False,
+            'stale': False,
+            'version': None,
+            'rows': 0,
+            'load_duration': None,
+            'loaded_at': None,
+        }
+
+    try:
+        stale = data_version(store['path']) != store['version']
+    except OSError:
+        stale = True
+
+    return {
+        'ready': True,
+        'stale': stale,
+        'version': store['version'],
+        'rows': store['rows'],
+        'load_duration': store['duration'],
+        'loaded_at': store['loaded_at'].isoformat(),
+    }
+
+
+def get_data():
+    """
+    Returns presence data grouped by user_id.
+
+    It creates structure like this:
+    data = {
+        'user_id': {
+            datetime.date(2013, 10, 1): {
+                'start': datetime.time(9, 0, 0),
+                'end': datetime.time(17, 30, 0),
+            },
+            datetime.date(2013, 10, 2): {
+                'start': datetime.time(8, 30, 0),
+                'end': datetime.time(16, 45, 0),
+            },
+        }
+    }
+    """
+    return load_data()['data']
+
+
+def get_weekdays():
+    """
+    Returns presence intervals of every user grouped by weekday.
+    """
+    return load_data()['weekdays']
 
 
 def group_by_weekday(items):
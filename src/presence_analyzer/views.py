@@ -5,11 +5,23 @@ Defines views.
 
 import calendar
 import logging
+from datetime import datetime
+from json import dumps
 
-from flask import redirect, abort
+from flask import Response, redirect, abort, request
 
 from main import app  # pylint: disable=relative-import
-from utils import jsonify, get_data, mean, group_by_weekday
+from utils import (  # pylint: disable=relative-import
+    jsonify,
+    precomputed,
+    load_data,
+    get_data,
+    get_weekdays,
+    mean,
+    data_status,
+    top_users,
+    TOP_METRICS,
+)
 
 
 log = logging.getLogger(__name__)  # pylint: disable=invalid-name
@@ -23,7 +35,38 @@ def mainpage():
     return redirect('/static/presence_weekday.html')
 
 
+@app.route('/healthz', methods=['GET'])
+@jsonify
+def healthz_view():
+    """
+    Liveness check.
+    """
+    return {'status': 'ok'}
+
+
+@app.route('/readyz', methods=['GET'])
+def readyz_view():
+    """
+    Readiness check, reports loaded data version, row count and load time.
+
+    Without eager load presence data is loaded by this check, otherwise
+    it responds with 503 until data is loaded at startup.
+    """
+    if not app.config.get('EAGER_LOAD'):
+        try:
+            load_data()
+        except (IOError, OSError):
+            log.exception('Cannot load presence data')
+    status = data_status()
+    return Response(
+        dumps(status),
+        status=200 if status['ready'] else 503,
+        mimetype='application/json'
+    )
+
+
 @app.route('/api/v1/users', methods=['GET'])
+@precomputed('users')
 @jsonify
 def users_view():
     """
@@ -37,41 +80,74 @@ def users_view():
 
 
 @app.route('/api/v1/mean_time_weekday/<int:user_id>', methods=['GET'])
+@precomputed('mean_time_weekday')
 @jsonify
 def mean_time_weekday_view(user_id):
     """
     Returns mean presence time of given user grouped by weekday.
     """
-    data = get_data()
-    if user_id not in data:
+    weekdays = get_weekdays()
+    if user_id not in weekdays:
         log.debug('User %s not found!', user_id)
         abort(404)
 
-    weekdays = group_by_weekday(data[user_id])
     result = [
         (calendar.day_abbr[weekday], mean(intervals))
-        for weekday, intervals in enumerate(weekdays)
+        for weekday, intervals in enumerate(weekdays[user_id])
     ]
 
     return result
 
 
 @app.route('/api/v1/presence_weekday/<int:user_id>', methods=['GET'])
+@precomputed('presence_weekday')
 @jsonify
 def presence_weekday_view(user_id):
     """
     Returns total presence time of given user grouped by weekday.
     """
-    data = get_data()
-    if user_id not in data:
+    weekdays = get_weekdays()
+    if user_id not in weekdays:
         log.debug('User %s not found!', user_id)
         abort(404)
 
-    weekdays = group_by_weekday(data[user_id])
     result = [
         (calendar.day_abbr[weekday], sum(intervals))
-        for weekday, intervals in enumerate(weekdays)
+        for weekday, intervals in enumerate(weekdays[user_id])
     ]
 
     result.insert(0, ('Weekday', 'Presence (s)'))
     return result
+
+
+@app.route('/api/v1/top/<metric>', methods=['GET'])
+@jsonify
+def top_view(metric):
+    """
+    Returns top users by given metric in optional period.
+
+    Metrics are total `presence` time, `earliest_arrival` and
+    `latest_departure` (average time since midnight), all in seconds.
+
+    Accepts `n` (number of users, 10 by default) and `from`/`to` dates
+    (YYYY-MM-DD, inclusive) query parameters.
+    """
+    if metric not in TOP_METRICS:
+        log.debug('Metric %s not found!', metric)
+        abort(404)
+
+    try:
+        count = int(request.args.get('n', 10))
+        start, end = [
+            datetime.strptime(request.args[arg], '%Y-%m-%d').date()
+            if request.args.get(arg) else None
+            for arg in ('from', 'to')
+        ]
+    except ValueError:
+        log.debug('Invalid parameters of top %s!', metric, exc_info=True)
+        abort(400)
+
+    if count < 1:
+        abort(400)
+
+    return top_users(metric, count, start, end)